@@ -1,16 +1,31 @@
 from __future__ import annotations
 
 import argparse
+import atexit
 import contextlib
+import email.utils
+import functools
+import hashlib
+import http.client
+import importlib.util
+import os
 import pathlib
 import platform
+import shutil
+import stat
 import subprocess
 import sys
+import tempfile
+import time
+import urllib.error
 import urllib.request
-from tempfile import NamedTemporaryFile
 from typing import NamedTuple
 from typing import Optional
 
+TEST_SCRIPT_MAX_AGE = 24 * 60 * 60  # Seconds
+# Setting this environment variable to any non-empty value disables caching
+NO_CACHE_ENVIRONMENT_VARIABLE = "POETRY_DEPENDENCIES_CHECKER_NO_CACHE"
+
 
 class ProgramArguments(NamedTuple):
     junit_xml: Optional[str]
@@ -20,12 +35,14 @@ class ProgramArguments(NamedTuple):
 
 def _custom_pytest_executable(custom_pytest_executable: str) -> pathlib.Path:
     pytest = pathlib.Path(custom_pytest_executable)
-    if not pytest.exists():
+    try:
+        pytest_stat = pytest.stat()
+    except FileNotFoundError:
         raise argparse.ArgumentTypeError(f"{pytest} does not exist")
-    elif not pytest.is_file():
+    except OSError as ose:
+        raise argparse.ArgumentTypeError(f"{pytest} is not accessible: {ose.strerror}")
+    if not stat.S_ISREG(pytest_stat.st_mode):
         raise argparse.ArgumentTypeError(f"{pytest} is not a file")
-    elif not pytest.parent.exists():
-        raise argparse.ArgumentTypeError(f"{pytest} parent directory does not exist")
     return pathlib.Path(pytest)
 
 
@@ -62,13 +79,25 @@ def _setup_arguments() -> ProgramArguments:
 
 
 def _check_python_version():
-    if sys.version_info.major >= 3 and sys.version_info.minor >= 6:
+    if sys.version_info[:2] >= (3, 6):
         return
     raise IOError(
         f"Python 3.6+ is required, currently using {platform.python_version()}"
     )
 
 
+def _vendor_directory() -> Optional[pathlib.Path]:
+    # Wheels bundled next to the script allow installing pytest offline.
+    # Not applicable when the script is piped to the interpreter.
+    script = pathlib.Path(globals().get("__file__", "<stdin>"))
+    if not script.is_file():
+        return None
+    vendor_directory = script.resolve().parent / "vendor"
+    if not any(vendor_directory.glob("pytest-*.whl")):
+        return None
+    return vendor_directory
+
+
 def _ensure_pytest(
     custom_pytest_executable: Optional[pathlib.Path],
     allow_install: bool,
@@ -78,42 +107,171 @@ def _ensure_pytest(
         return
 
     python = pathlib.Path(sys.executable)
+    if importlib.util.find_spec("pytest") is not None:
+        return
+    elif not allow_install:
+        raise IOError("pytest is not installed and installing it is prohibited")
+
+    pip_options = []
+    vendor_directory = _vendor_directory()
+    if vendor_directory:
+        pip_options = ["--no-index", "--find-links", str(vendor_directory)]
+
+    install_arguments = [*pip_options, "pytest"]
+    print(f"> {python.name} -m pip install {' '.join(install_arguments)}")
     try:
         subprocess.run(
-            (python, "-m", "pytest", "--version"),
-            capture_output=True,
+            (python, "-m", "pip", "install", *install_arguments),
             check=True,
         )
     except subprocess.CalledProcessError as cpe:
-        if not allow_install:
-            raise IOError(
-                "pytest is not installed and installing it is prohibited"
-            ) from cpe
-    else:
-        return
+        raise IOError("Failed to install pytest") from cpe
+
+
+# Keep in sync with _ensure_private_directory in test_poetry_dependencies.py
+def _ensure_private_directory(directory: pathlib.Path):
+    directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+    directory_stat = directory.lstat()
+    if not stat.S_ISDIR(directory_stat.st_mode):
+        raise IOError(f"{directory} is not a directory")
+    if not hasattr(os, "getuid"):
+        return  # Windows, user profile directories are private already
+    if directory_stat.st_uid != os.getuid():
+        raise IOError(f"{directory} is not owned by the current user")
+    if stat.S_IMODE(directory_stat.st_mode) & 0o077:
+        directory.chmod(0o700)
+
+
+@functools.lru_cache(maxsize=1)
+def _cache_directory() -> pathlib.Path:
+    # Test script is executed from this directory and it becomes the first
+    # entry on sys.path, so it must not be writable by other users
+    if not os.environ.get(NO_CACHE_ENVIRONMENT_VARIABLE):
+        # Keep in sync with _pypi_cache_directory in test_poetry_dependencies.py
+        try:
+            cache_home = (
+                os.environ.get("XDG_CACHE_HOME") or pathlib.Path.home() / ".cache"
+            )
+            cache_directory = pathlib.Path(cache_home, "poetry-dependencies-checker")
+            _ensure_private_directory(cache_directory)
+        except (OSError, RuntimeError, KeyError) as error:
+            print(f"Warning: Cannot use cache directory ({error}), caching is disabled")
+        else:
+            return cache_directory
+
+    cache_directory = pathlib.Path(
+        tempfile.mkdtemp(prefix="poetry-dependencies-checker-")
+    )
+    atexit.register(shutil.rmtree, cache_directory, ignore_errors=True)
+    return cache_directory
+
+
+class CachedScript(NamedTuple):
+    path: pathlib.Path
+    mtime: float
+
 
-    print(f"> {python.name} -m pip install pytest")
+def _is_intact(script_path: pathlib.Path, script_prefix: str) -> bool:
+    # Cached scripts are named after the beginning of their SHA-256 digest
+    expected_digest = script_path.stem[len(script_prefix) :]
     try:
-        subprocess.run((python, "-m", "pip", "install", "pytest"), check=True)
-    except subprocess.CalledProcessError as cpe:
-        raise IOError("Failed to install pytest") from cpe
+        digest = hashlib.sha256(script_path.read_bytes()).hexdigest()
+    except OSError:
+        return False
+    return bool(expected_digest) and digest.startswith(expected_digest)
+
+
+def _find_cached_script(
+    cache_directory: pathlib.Path,
+    script_prefix: str,
+) -> Optional[CachedScript]:
+    cached_scripts = []
+    for script_path in cache_directory.glob(f"{script_prefix}*.py"):
+        try:
+            script_mtime = script_path.stat().st_mtime
+        except FileNotFoundError:
+            continue  # Removed by a concurrent run
+        cached_scripts.append(CachedScript(script_path, script_mtime))
+    # The most recently validated intact script wins
+    for cached_script in sorted(cached_scripts, key=lambda c: c.mtime, reverse=True):
+        if _is_intact(cached_script.path, script_prefix):
+            return cached_script
+    return None
+
+
+def _download_test_script(
+    tests_script_url: str,
+    cache_directory: pathlib.Path,
+    script_prefix: str,
+    cached_script: Optional[CachedScript],
+) -> pathlib.Path:
+    request = urllib.request.Request(tests_script_url)
+    if cached_script:
+        last_modified = email.utils.formatdate(cached_script.mtime, usegmt=True)
+        request.add_header("If-Modified-Since", last_modified)
+        with contextlib.suppress(OSError):
+            etag = cached_script.path.with_suffix(".etag").read_text()
+            request.add_header("If-None-Match", etag)
+
+    partial_path = cache_directory / f"{script_prefix}{os.getpid()}.part"
+    digest = hashlib.sha256()
+    try:
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                etag = response.headers.get("ETag")
+                with open(partial_path, "wb") as f:
+                    for chunk in iter(lambda: response.read(1 << 16), b""):
+                        digest.update(chunk)
+                        f.write(chunk)
+                # Reading in chunks does not detect a prematurely closed connection
+                if response.length:
+                    raise IOError("Connection closed before test script was downloaded")
+        except urllib.error.HTTPError as he:
+            if he.code != 304 or not cached_script:
+                raise
+            # Cached copy is still up to date, mark it as fresh again
+            with contextlib.suppress(OSError):
+                cached_script.path.touch()
+            return cached_script.path
+
+        script_path = cache_directory / f"{script_prefix}{digest.hexdigest()[:12]}.py"
+        os.replace(partial_path, script_path)
+    finally:
+        with contextlib.suppress(OSError):
+            partial_path.unlink()
+
+    if etag:
+        with contextlib.suppress(OSError):
+            script_path.with_suffix(".etag").write_text(etag)
+    if cached_script and cached_script.path != script_path:
+        with contextlib.suppress(OSError):
+            cached_script.path.unlink()
+            cached_script.path.with_suffix(".etag").unlink()
+    return script_path
 
 
-@contextlib.contextmanager
-def _test_script(ref="main") -> pathlib.Path:
+@functools.lru_cache(maxsize=1)
+def _test_script_path(ref="main") -> pathlib.Path:
     repo_slug = "NevercodeHQ/poetry-dependencies-checker"
     tests_script_url = f"https://raw.githubusercontent.com/{repo_slug}/{ref}/test_poetry_dependencies.py"
-    with urllib.request.urlopen(tests_script_url) as response:
-        tests_script: bytes = response.read()
+    script_prefix = f"nc-poetry-deps-{ref}-"
+    cache_directory = _cache_directory()
 
-    with NamedTemporaryFile(
-        prefix="test-poetry-dependencies-",
-        suffix=".py",
-        dir=pathlib.Path("."),
-    ) as tf:
-        tf.write(tests_script)
-        tf.flush()
-        yield pathlib.Path(tf.name)
+    cached_script = _find_cached_script(cache_directory, script_prefix)
+    if cached_script and time.time() - cached_script.mtime < TEST_SCRIPT_MAX_AGE:
+        return cached_script.path
+    try:
+        return _download_test_script(
+            tests_script_url, cache_directory, script_prefix, cached_script
+        )
+    except (OSError, http.client.HTTPException) as error:
+        if not cached_script:
+            raise
+        # Allow working offline with a previously downloaded copy
+        print(
+            f"Warning: Failed to update test script ({error}), using {cached_script.path}"
+        )
+        return cached_script.path
 
 
 def _run_tests(
@@ -121,13 +279,33 @@ def _run_tests(
     test_file: pathlib.Path,
     junit_xml: Optional[pathlib.Path],
 ):
-    if pytest_executable:
-        test_command = [pytest_executable, test_file, "--noconftest"]
-    else:
-        test_command = [sys.executable, "-m", "pytest", test_file, "--noconftest"]
-
+    # Run isolated from any pytest configuration of the checked project or
+    # directories above the cached test script, such as addopts or plugins
+    pytest_arguments = [
+        str(test_file),
+        "--noconftest",
+        "-p",
+        "no:cacheprovider",
+        "-c",
+        os.devnull,
+        "--rootdir",
+        str(test_file.parent),
+    ]
     if junit_xml:
-        test_command.extend(["--junitxml", junit_xml])
+        pytest_arguments.extend(["--junitxml", str(junit_xml)])
+
+    if not pytest_executable:
+        # pytest might have been installed just now by this process
+        importlib.invalidate_caches()
+        try:
+            import pytest
+        except ImportError:
+            pass
+        else:
+            return int(pytest.main(pytest_arguments))
+        test_command = [sys.executable, "-m", "pytest", *pytest_arguments]
+    else:
+        test_command = [pytest_executable, *pytest_arguments]
 
     cp = subprocess.run(test_command)
     return cp.returncode
@@ -141,12 +319,11 @@ def main():
             program_arguments.pytest_executable,
             not program_arguments.no_pytest_install,
         )
-        with _test_script() as tests_path:
-            return _run_tests(
-                program_arguments.pytest_executable,
-                tests_path,
-                junit_xml=program_arguments.junit_xml,
-            )
+        return _run_tests(
+            program_arguments.pytest_executable,
+            _test_script_path(),
+            junit_xml=program_arguments.junit_xml,
+        )
     except IOError as ioe:
         print(f"Error: {ioe}")
         return 1
@@ -2,15 +2,32 @@
 
 from __future__ import annotations
 
+import contextlib
+import functools
 import importlib
 import json
+import os
+import pathlib
+import re
+import stat
+import threading
+import time
+import urllib.error
 import urllib.request
 import warnings
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict
+from typing import Iterator
 from typing import NamedTuple
+from typing import Optional
 
 import pytest
 from packaging.specifiers import SpecifierSet
+from packaging.utils import canonicalize_name
+from packaging.utils import parse_sdist_filename
+from packaging.utils import parse_wheel_filename
+from packaging.version import InvalidVersion
 from packaging.version import Version
 
 # tomllib is added in Python 3.11. In case this is not available,
@@ -27,35 +44,174 @@ else:
     raise ImportError("Failed to import TOML parsing package")
 
 
-@pytest.fixture()
-def locked_versions() -> Dict[str, Version]:
-    with open("poetry.lock") as f:
-        lock_info = tomllib.loads(f.read())
+_FROZEN_VERSION_RE = re.compile(r"\d+\.\d+\.\d+")
+
+PYPI_CACHE_MAX_AGE = 60 * 60  # Seconds
+# Setting this environment variable to any non-empty value disables caching
+NO_CACHE_ENVIRONMENT_VARIABLE = "POETRY_DEPENDENCIES_CHECKER_NO_CACHE"
+
+
+def _read_toml(path: str) -> dict:
+    with open(path, "rb") as f:
+        if tomllib.__name__ == "toml":
+            # Unlike tomllib and tomli, toml package only parses text
+            return tomllib.loads(f.read().decode())
+        return tomllib.load(f)
+
 
+@functools.lru_cache(maxsize=None)
+def _load_pyproject() -> dict:
+    return _read_toml("pyproject.toml")
+
+
+@functools.lru_cache(maxsize=None)
+def _load_lock() -> dict:
+    return _read_toml("poetry.lock")
+
+
+@pytest.fixture(scope="session")
+def locked_versions() -> Dict[str, Version]:
+    lock_info = _load_lock()
     return {
-        package["name"].lower(): Version(package["version"])
+        canonicalize_name(package["name"]): Version(package["version"])
         for package in lock_info["package"]
     }
 
 
+@pytest.fixture(scope="session")
+def latest_versions() -> Iterator[Dict[str, Future[Version]]]:
+    # Query PyPI for all dependencies concurrently up front instead of
+    # doing one blocking request per test case. Each test waits only for
+    # its own lookup, which also keeps failures attributed to the affected
+    # test. Frozen dependencies are skipped without consulting PyPI.
+    dependencies = [d for d in Dependency.load() if not d.is_frozen()]
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        yield {
+            dependency.canonical_name: executor.submit(dependency.get_latest_version)
+            for dependency in dependencies
+        }
+
+
+class PyPICacheEntry(NamedTuple):
+    etag: Optional[str]
+    version: Version
+    age: float
+
+
+# Keep in sync with _ensure_private_directory in check-dependencies.py
+def _ensure_private_directory(directory: pathlib.Path):
+    directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+    directory_stat = directory.lstat()
+    if not stat.S_ISDIR(directory_stat.st_mode):
+        raise IOError(f"{directory} is not a directory")
+    if not hasattr(os, "getuid"):
+        return  # Windows, user profile directories are private already
+    if directory_stat.st_uid != os.getuid():
+        raise IOError(f"{directory} is not owned by the current user")
+    if stat.S_IMODE(directory_stat.st_mode) & 0o077:
+        directory.chmod(0o700)
+
+
+@functools.lru_cache(maxsize=1)
+def _pypi_cache_directory() -> Optional[pathlib.Path]:
+    # Cached versions decide the check outcome, so they must not be
+    # writable by other users. Caching is skipped if that is not possible.
+    if os.environ.get(NO_CACHE_ENVIRONMENT_VARIABLE):
+        return None
+    # Keep in sync with _cache_directory in check-dependencies.py
+    try:
+        cache_home = os.environ.get("XDG_CACHE_HOME") or pathlib.Path.home() / ".cache"
+        cache_directory = pathlib.Path(cache_home, "poetry-dependencies-checker")
+        pypi_cache_directory = cache_directory / "pypi"
+        _ensure_private_directory(pypi_cache_directory)
+    except (OSError, RuntimeError, KeyError):
+        return None
+    return pypi_cache_directory
+
+
+def _read_pypi_cache(cache_path: pathlib.Path) -> Optional[PyPICacheEntry]:
+    try:
+        with open(cache_path, "rb") as f:
+            cache_age = time.time() - os.fstat(f.fileno()).st_mtime
+            cache_entry = json.load(f)
+        etag = cache_entry["etag"]
+        version = Version(cache_entry["version"])
+    except (OSError, ValueError, LookupError, TypeError, InvalidVersion):
+        return None
+    if etag is not None and not isinstance(etag, str):
+        return None
+    return PyPICacheEntry(etag, version, cache_age)
+
+
+def _write_pypi_cache(cache_path: pathlib.Path, etag: Optional[str], version: Version):
+    partial_path = cache_path.with_name(
+        f"{cache_path.name}.{os.getpid()}.{threading.get_ident()}.part"
+    )
+    # Cache is only an optimization, failing to update it is not an error
+    with contextlib.suppress(OSError):
+        try:
+            with open(partial_path, "w") as f:
+                json.dump({"etag": etag, "version": str(version)}, f)
+            os.replace(partial_path, cache_path)
+        finally:
+            with contextlib.suppress(OSError):
+                partial_path.unlink()
+
+
+def _distribution_version(filename: str) -> Optional[Version]:
+    try:
+        if filename.endswith(".whl"):
+            return parse_wheel_filename(filename)[1]
+        return parse_sdist_filename(filename)[1]
+    except ValueError:
+        # Legacy distribution formats or names that cannot be parsed
+        return None
+
+
+def _latest_release(project: dict) -> Version:
+    yanked_versions = set()
+    available_versions = set()
+    for distribution in project.get("files", []):
+        version = _distribution_version(distribution["filename"])
+        if distribution.get("yanked"):
+            yanked_versions.add(version)
+        else:
+            available_versions.add(version)
+    # Release is yanked only if none of its files can be installed
+    yanked_versions -= available_versions
+
+    versions = []
+    for version_string in project["versions"]:
+        try:
+            version = Version(version_string)
+        except InvalidVersion:
+            continue
+        if version not in yanked_versions:
+            versions.append(version)
+
+    releases = [version for version in versions if not version.is_prerelease]
+    if not releases and not versions:
+        raise ValueError(f"No valid releases found for {project['name']}")
+    return max(releases or versions)
+
+
 class Dependency(NamedTuple):
     name: str
     version_constraint: str
+    canonical_name: str
 
     def is_frozen(self) -> bool:
         # Check if fully qualified semver is specified as version constraint
-        parts = self.version_constraint.split(".")
-        return len(parts) == 3 and all(part.isdigit() for part in parts)
+        return _FROZEN_VERSION_RE.fullmatch(self.version_constraint) is not None
 
     @classmethod
     def load(cls):
-        with open("pyproject.toml") as f:
-            project_info = tomllib.loads(f.read())
-
+        project_info = _load_pyproject()
         for name, version_info in project_info["tool"]["poetry"][
             "dependencies"
         ].items():
-            if name.lower() == "python":
+            canonical_name = canonicalize_name(name)
+            if canonical_name == "python":
                 continue
             if isinstance(version_info, str):
                 version_constraint = version_info
@@ -64,30 +220,72 @@ class Dependency(NamedTuple):
             else:
                 warnings.warn(f"Failed to obtain version constraint for {name}")
                 continue
-            yield Dependency(name, version_constraint)
+            yield Dependency(name, version_constraint, canonical_name)
 
+    @functools.lru_cache(maxsize=None)
     def get_latest_version(self) -> Version:
-        with urllib.request.urlopen(
-            f"https://pypi.org/pypi/{self.name}/json"
-        ) as response:
-            payload = json.load(response)
-        return Version(payload["info"]["version"])
+        # Latest versions rarely change between consecutive runs, reuse
+        # the result of the previous lookup while it is recent enough
+        cache_path = None
+        cache_entry = None
+        cache_directory = _pypi_cache_directory()
+        if cache_directory:
+            cache_path = cache_directory / f"{self.canonical_name}.json"
+            cache_entry = _read_pypi_cache(cache_path)
+        if cache_entry and cache_entry.age < PYPI_CACHE_MAX_AGE:
+            return cache_entry.version
+
+        # Simple repository API JSON response is considerably smaller than
+        # the full project metadata from https://pypi.org/pypi/{name}/json
+        headers = {"Accept": "application/vnd.pypi.simple.v1+json"}
+        if cache_entry and cache_entry.etag:
+            headers["If-None-Match"] = cache_entry.etag
+        request = urllib.request.Request(
+            f"https://pypi.org/simple/{self.canonical_name}/", headers=headers
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                content_type = response.headers.get_content_type()
+                etag = response.headers.get("ETag")
+                body = response.read()
+        except urllib.error.HTTPError as he:
+            if he.code == 304 and cache_entry:
+                with contextlib.suppress(OSError):
+                    cache_path.touch()
+                return cache_entry.version
+            raise IOError(
+                f"Failed to get {self.name} from PyPI: {he.code} {he.reason}"
+            ) from he
+
+        if content_type != "application/vnd.pypi.simple.v1+json":
+            raise IOError(
+                f"Unexpected response for {self.name} from PyPI: {content_type}"
+            )
+        latest_version = _latest_release(json.loads(body))
+        if cache_path:
+            _write_pypi_cache(cache_path, etag, latest_version)
+        return latest_version
 
 
 @pytest.mark.parametrize(
     "dependency", (pytest.param(d, id=d.name) for d in Dependency.load())
 )
-def test_dependencies(dependency: Dependency, locked_versions: Dict[str, Version]):
-    available_version = dependency.get_latest_version()
-    locked_version = locked_versions[dependency.name.lower()]
+def test_dependencies(
+    dependency: Dependency,
+    locked_versions: Dict[str, Version],
+    latest_versions: Dict[str, Future[Version]],
+):
+    locked_version = locked_versions[dependency.canonical_name]
 
     if dependency.is_frozen():
         skip_message = (
             f"{dependency.name} is frozen by constraint {dependency.version_constraint}. "
-            f"Version {locked_version} is used, but {available_version} is available."
+            f"Version {locked_version} is used."
         )
         pytest.skip(skip_message)
 
+    available_version = latest_versions[dependency.canonical_name].result()
+
     latest_version_specifier = SpecifierSet(
         f">={available_version.major}.{available_version.minor}"
     )